@@ -5,6 +5,7 @@ import httpx
 import os
 from dotenv import load_dotenv
 from typing import Dict, Optional
+import threading
 import time
 
 load_dotenv()
@@ -20,6 +21,7 @@ security = HTTPBearer()
 _jwks_cache = None
 _jwks_cache_time = 0
 _jwks_cache_ttl = 300  # 5 minutes
+_jwks_lock = threading.Lock()  # Only one thread refreshes the JWKS at a time
 
 class Auth0JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
@@ -52,10 +54,13 @@ class Auth0JWTBearer(HTTPBearer):
             current_time = time.time()
             
             if _jwks_cache is None or (current_time - _jwks_cache_time) > _jwks_cache_ttl:
-                jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
-                with httpx.Client() as client:
-                    _jwks_cache = client.get(jwks_url).json()
-                    _jwks_cache_time = current_time
+                with _jwks_lock:
+                    # Re-check: another thread may have refreshed while we waited
+                    if _jwks_cache is None or (time.time() - _jwks_cache_time) > _jwks_cache_ttl:
+                        jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+                        with httpx.Client() as client:
+                            _jwks_cache = client.get(jwks_url).json()
+                            _jwks_cache_time = time.time()
             
             jwks = _jwks_cache
             
@@ -88,6 +93,20 @@ class Auth0JWTBearer(HTTPBearer):
 
 auth_handler = Auth0JWTBearer()
 
+def verify_token(token: str) -> Optional[Dict]:
+    """Verify a raw JWT (e.g. from a WebSocket query string) and return its payload.
+
+    May block on a JWKS refresh, so async callers should run it in a threadpool.
+    """
+    if not token:
+        return None
+    try:
+        return auth_handler.decode_jwt(token)
+    except Exception:
+        # Malformed token or JWKS (e.g. an HTML error page), or a failed fetch;
+        # reject like Auth0JWTBearer.verify_jwt does for the HTTP routes
+        return None
+
 async def get_current_user(token: str = Security(auth_handler)):
     """Get current user from JWT token"""
     try:
@@ -171,6 +171,16 @@ class DeviceManager:
         
         return device is not None
     
+    def is_device_active_for_user(self, device_id: str, user_id: str) -> bool:
+        """Check if a device is active and belongs to the given user"""
+        device = self.db.query(DeviceSession).filter(
+            DeviceSession.device_id == device_id,
+            DeviceSession.user_id == user_id,
+            DeviceSession.is_active == "true"
+        ).first()
+        
+        return device is not None
+    
     def update_activity(self, device_id: str):
         """Update last activity for a device"""
         device = self.db.query(DeviceSession).filter(
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
@@ -10,7 +11,7 @@ from dotenv import load_dotenv
 from datetime import timezone
 
 from app.database import get_db
-from app.auth import get_current_user
+from app.auth import get_current_user, verify_token
 from app.device_manager import DeviceManager
 from app.websocket_manager import manager
 
@@ -195,35 +196,64 @@ async def check_device_status(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def device_belongs_to_user(device_id: str, user_id: str) -> bool:
+    """Check that user_id owns an active session for device_id"""
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        return DeviceManager(db).is_device_active_for_user(device_id, user_id)
+    finally:
+        db_gen.close()
+
+def authorize_websocket(token: str, device_id: str) -> Optional[str]:
+    """Return the user_id if the token is valid and owns an active session for device_id"""
+    payload = verify_token(token)
+    if not payload or not payload.get("sub"):
+        return None
+    user_id = payload["sub"]
+    if not device_belongs_to_user(device_id, user_id):
+        return None
+    return user_id
+
 @app.websocket("/ws/{device_id}")
 async def websocket_endpoint(websocket: WebSocket, device_id: str, token: str = Query(...)):
     """WebSocket endpoint for real-time notifications"""
+    # Authorize before accepting so bad sockets are refused during the handshake.
+    # JWKS refreshes and the DB lookup block, so keep them off the event loop.
+    user_id = await run_in_threadpool(authorize_websocket, token, device_id)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    if not await manager.connect(websocket, device_id, user_id):
+        return
+    
+    # A force-logout landing between the check above and connect() found no
+    # socket to notify; re-check now that this socket is registered
+    if not await run_in_threadpool(device_belongs_to_user, device_id, user_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        manager.disconnect(device_id, websocket)
+        return
+    
     try:
-        # Verify token (simplified for demo)
-        # In production, you'd want to properly verify the JWT token here
-        user_id = "user_" + device_id  # Simplified user identification
-        
-        await manager.connect(websocket, device_id, user_id)
-        
-        try:
-            while True:
-                # Keep connection alive and handle incoming messages
-                data = await websocket.receive_text()
-                message = json.loads(data)
+        while True:
+            # Keep connection alive and handle incoming messages
+            data = await websocket.receive_text()
+            message = json.loads(data)
+            
+            if message.get("type") == "ping":
+                await websocket.send_text(json.dumps({"type": "pong"}))
+            elif message.get("type") == "activity":
+                # Update device activity in database
+                db = next(get_db())
+                device_manager = DeviceManager(db)
+                device_manager.update_activity(device_id)
                 
-                if message.get("type") == "ping":
-                    await websocket.send_text(json.dumps({"type": "pong"}))
-                elif message.get("type") == "activity":
-                    # Update device activity in database
-                    db = next(get_db())
-                    device_manager = DeviceManager(db)
-                    device_manager.update_activity(device_id)
-                    
-        except WebSocketDisconnect:
-            manager.disconnect(device_id)
+    except WebSocketDisconnect:
+        manager.disconnect(device_id, websocket)
     except Exception as e:
         print(f"WebSocket error: {e}")
-        manager.disconnect(device_id)
+        manager.disconnect(device_id, websocket)
 
 if __name__ == "__main__":
     import uvicorn
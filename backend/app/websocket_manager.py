@@ -1,64 +1,130 @@
-from fastapi import WebSocket
-from typing import Dict, List
+from fastapi import WebSocket, status
+from typing import Dict, List, Optional, Set
 import json
 import asyncio
 
+from app.device_manager import MAX_DEVICES
+
+# Close code sent to a socket superseded by a newer connection for the same
+# device; clients should not try to reconnect when they see it
+WS_REPLACED_CLOSE_CODE = 4000
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, max_connections_per_user: int = MAX_DEVICES):
         # Store connections by device_id
         self.active_connections: Dict[str, WebSocket] = {}
         # Store device_id to user_id mapping
         self.device_user_mapping: Dict[str, str] = {}
+        # Store user_id to device_ids mapping (for per-user caps and fan-out)
+        self.user_devices: Dict[str, Set[str]] = {}
+        # Devices whose handshake has been reserved but not yet accepted
+        self.pending_devices: Set[str] = set()
+        # Strong references so fire-and-forget tasks are not garbage-collected
+        self._background_tasks: Set[asyncio.Task] = set()
+        self.max_connections_per_user = max_connections_per_user
+    
+    def rejection_reason(self, device_id: str, user_id: str) -> Optional[str]:
+        """Return why a new connection would be refused, or None if it is allowed"""
+        owner = self.device_user_mapping.get(device_id)
+        if owner is not None and owner != user_id:
+            return "Device connected for another user"
+        if device_id in self.pending_devices:
+            return "Device handshake already in progress"
+        # Replacing an existing socket for this device does not use a new slot
+        if owner is None and len(self.user_devices.get(user_id, ())) >= self.max_connections_per_user:
+            return f"Maximum {self.max_connections_per_user} connections allowed"
+        return None
     
-    async def connect(self, websocket: WebSocket, device_id: str, user_id: str):
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, device_id: str, user_id: str) -> bool:
+        """Accept the socket if the device and user are within limits.
+
+        Rejected sockets are closed before the handshake completes, so they
+        never reach the accepted state. An existing socket for the same device
+        and user is replaced, since it may be dead or left over from a reload.
+        """
+        reason = self.rejection_reason(device_id, user_id)
+        if reason:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            print(f"Device {device_id} rejected for user {user_id}: {reason}")
+            return False
+        
+        previous = self.active_connections.get(device_id)
+        
+        # Reserve the slot before awaiting anything so concurrent handshakes
+        # for the same device or user cannot both pass the limit check
         self.active_connections[device_id] = websocket
         self.device_user_mapping[device_id] = user_id
+        self.user_devices.setdefault(user_id, set()).add(device_id)
+        self.pending_devices.add(device_id)
+        try:
+            if previous is not None:
+                # Close in the background: a dead peer can stall the close handshake
+                task = asyncio.ensure_future(self._close_quietly(previous, WS_REPLACED_CLOSE_CODE))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                print(f"Device {device_id} replaced its previous connection")
+            await websocket.accept()
+        except Exception:
+            self.disconnect(device_id, websocket)
+            raise
+        finally:
+            self.pending_devices.discard(device_id)
         print(f"Device {device_id} connected for user {user_id}")
+        return True
+    
+    async def _close_quietly(self, websocket: WebSocket, code: int = status.WS_1000_NORMAL_CLOSURE):
+        try:
+            await websocket.close(code=code)
+        except:
+            pass
     
-    def disconnect(self, device_id: str):
+    def disconnect(self, device_id: str, websocket: Optional[WebSocket] = None):
+        # Ignore stale disconnects for a socket that no longer owns this device
+        if websocket is not None and self.active_connections.get(device_id) is not websocket:
+            return
         if device_id in self.active_connections:
             del self.active_connections[device_id]
-        if device_id in self.device_user_mapping:
-            del self.device_user_mapping[device_id]
+        user_id = self.device_user_mapping.pop(device_id, None)
+        if user_id is not None:
+            devices = self.user_devices.get(user_id)
+            if devices is not None:
+                devices.discard(device_id)
+                if not devices:
+                    del self.user_devices[user_id]
         print(f"Device {device_id} disconnected")
     
     async def send_personal_message(self, message: str, device_id: str):
-        if device_id in self.active_connections:
+        websocket = self.active_connections.get(device_id)
+        if websocket is not None:
             try:
-                await self.active_connections[device_id].send_text(message)
+                await websocket.send_text(message)
             except:
                 # Connection might be closed, remove it
-                self.disconnect(device_id)
+                self.disconnect(device_id, websocket)
     
     async def send_logout_notification(self, device_id: str, message: str = "You have been logged out from another device"):
         """Send logout notification to a specific device"""
-        if device_id in self.active_connections:
+        websocket = self.active_connections.get(device_id)
+        if websocket is not None:
             logout_message = {
                 "type": "force_logout",
                 "message": message,
                 "timestamp": str(asyncio.get_event_loop().time())
             }
             try:
-                await self.active_connections[device_id].send_text(json.dumps(logout_message))
+                await websocket.send_text(json.dumps(logout_message))
                 # Give some time for the message to be received
                 await asyncio.sleep(1)
             except:
                 pass
             finally:
-                # Close the connection
-                try:
-                    await self.active_connections[device_id].close()
-                except:
-                    pass
-                self.disconnect(device_id)
+                # Close the connection (not any socket that reconnected meanwhile)
+                await self._close_quietly(websocket)
+                self.disconnect(device_id, websocket)
     
     async def notify_user_devices(self, user_id: str, message: dict):
         """Send notification to all devices of a user"""
-        devices_to_notify = [
-            device_id for device_id, uid in self.device_user_mapping.items() 
-            if uid == user_id
-        ]
+        devices_to_notify = list(self.user_devices.get(user_id, ()))
         
         for device_id in devices_to_notify:
             await self.send_personal_message(json.dumps(message), device_id)
@@ -0,0 +1,116 @@
+"""Measure WebSocket handshake throughput against the app under concurrent load.
+
+Runs the app in-process with uvicorn against a throwaway SQLite database,
+signs real RS256 tokens with a local key and pre-seeds the JWKS cache with
+it, so each handshake goes through the full verify -> ownership check ->
+accept path without calling Auth0.
+
+Usage (from backend/):
+    python scripts/ws_handshake_load.py --users 50 --rounds 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load_devices.db")
+
+import uvicorn
+import websockets
+
+from app import auth
+from app.database import DeviceSession, SessionLocal
+from app.device_manager import MAX_DEVICES
+from app.main import app
+from tests.auth_helpers import auth_settings, generate_signing_key, make_token
+
+
+def configure_auth() -> bytes:
+    pem, public_jwk = generate_signing_key()
+    for name, value in auth_settings(public_jwk, cache_ttl=3600).items():
+        setattr(auth, name, value)
+    return pem
+
+
+def seed_devices(users: int) -> list:
+    """Create MAX_DEVICES active sessions per user; return (user_id, device_id) pairs"""
+    pairs = [(f"user-{u}", f"device-{u}-{d}") for u in range(users) for d in range(MAX_DEVICES)]
+    db = SessionLocal()
+    db.add_all([
+        DeviceSession(user_id=user_id, device_id=device_id, device_info="load", is_active="true")
+        for user_id, device_id in pairs
+    ])
+    db.commit()
+    db.close()
+    return pairs
+
+
+async def handshake_worker(url: str, rounds: int, latencies: list, expect_accept: bool) -> int:
+    failures = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        try:
+            async with websockets.connect(url, open_timeout=30):
+                pass
+            ok = expect_accept
+        except (websockets.InvalidStatusCode, websockets.ConnectionClosed):
+            ok = not expect_accept
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            failures += 1
+    return failures
+
+
+async def run_phase(name: str, urls: list, rounds: int, expect_accept: bool):
+    latencies = []
+    start = time.perf_counter()
+    failures = await asyncio.gather(*[
+        handshake_worker(url, rounds, latencies, expect_accept) for url in urls
+    ])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<9} concurrency={len(urls):<4} handshakes={len(latencies):<6} "
+        f"rate={len(latencies) / elapsed:8.1f}/s  p50={statistics.median(latencies) * 1000:6.1f}ms  "
+        f"p95={p95 * 1000:6.1f}ms  unexpected={sum(failures)}"
+    )
+
+
+async def main(args):
+    pem = configure_auth()
+    pairs = seed_devices(args.users)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base = f"ws://127.0.0.1:{port}/ws"
+    tokens = {user_id: make_token(pem, user_id, expires_in=3600) for user_id, _ in pairs}
+    accepted_urls = [f"{base}/{device_id}?token={tokens[user_id]}" for user_id, device_id in pairs]
+    # Valid token for another user's device: rejected by the ownership check
+    foreign_urls = [f"{base}/{pairs[-1][1]}?token={tokens[user_id]}" for user_id, _ in pairs[:-MAX_DEVICES]]
+    invalid_urls = [f"{base}/{device_id}?token=invalid" for _, device_id in pairs]
+
+    await run_phase("accepted", accepted_urls, args.rounds, expect_accept=True)
+    await run_phase("foreign", foreign_urls, args.rounds, expect_accept=False)
+    await run_phase("invalid", invalid_urls, args.rounds, expect_accept=False)
+
+    server.should_exit = True
+    await server_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help=f"users, each with {MAX_DEVICES} devices")
+    parser.add_argument("--rounds", type=int, default=20, help="handshakes per device")
+    asyncio.run(main(parser.parse_args()))
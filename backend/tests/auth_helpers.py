@@ -0,0 +1,40 @@
+"""Local RS256 signing for tests and load scripts, so Auth0 is never called."""
+import time
+from typing import Dict, Tuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+KID = "local-test-key"
+AUDIENCE = "https://api.test"
+ISSUER = "https://issuer.test/"
+
+
+def generate_signing_key() -> Tuple[bytes, Dict]:
+    """Return a private key PEM and the matching public JWK"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    return pem, {"kid": KID, "use": "sig", **public}
+
+
+def auth_settings(public_jwk: Dict, cache_ttl: int = 300) -> Dict:
+    """app.auth module attributes that make it trust public_jwk from a warm JWKS cache"""
+    return {
+        "_jwks_cache": {"keys": [public_jwk]},
+        "_jwks_cache_time": time.time(),
+        "_jwks_cache_ttl": cache_ttl,
+        "AUTH0_API_AUDIENCE": AUDIENCE,
+        "AUTH0_ISSUER": ISSUER,
+        "AUTH0_ALGORITHMS": "RS256",
+    }
+
+
+def make_token(pem: bytes, sub: str, expires_in: int = 60) -> str:
+    claims = {"sub": sub, "aud": AUDIENCE, "iss": ISSUER, "exp": int(time.time()) + expires_in}
+    return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": KID})
@@ -0,0 +1,107 @@
+import json
+
+import httpx
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app.main as main
+from app import auth
+from app.database import DeviceSession, SessionLocal
+from app.main import app
+from app.websocket_manager import manager
+from tests.auth_helpers import auth_settings, generate_signing_key, make_token
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    return generate_signing_key()
+
+
+@pytest.fixture(autouse=True)
+def auth0_config(monkeypatch, signing_key):
+    _, public_jwk = signing_key
+    for name, value in auth_settings(public_jwk).items():
+        monkeypatch.setattr(auth, name, value)
+
+
+@pytest.fixture(autouse=True)
+def device_sessions():
+    db = SessionLocal()
+    db.add_all([
+        DeviceSession(user_id="user-a", device_id="device-a", device_info="A", is_active="true"),
+        DeviceSession(user_id="user-b", device_id="device-b", device_info="B", is_active="true"),
+        DeviceSession(user_id="user-a", device_id="device-old", device_info="Old", is_active="false"),
+    ])
+    db.commit()
+    yield
+    db.query(DeviceSession).delete()
+    db.commit()
+    db.close()
+
+
+def assert_rejected(client: TestClient, url: str):
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect(url):
+            pass
+    assert exc_info.value.code == status.WS_1008_POLICY_VIOLATION
+
+
+def test_owned_active_device_is_accepted(signing_key):
+    client = TestClient(app)
+    token = make_token(signing_key[0], "user-a")
+    with client.websocket_connect(f"/ws/device-a?token={token}") as websocket:
+        websocket.send_text(json.dumps({"type": "ping"}))
+        assert json.loads(websocket.receive_text()) == {"type": "pong"}
+        assert manager.device_user_mapping["device-a"] == "user-a"
+    assert "device-a" not in manager.active_connections
+
+
+def test_invalid_token_is_rejected():
+    assert_rejected(TestClient(app), "/ws/device-a?token=not-a-jwt")
+
+
+def test_device_of_another_user_is_rejected(signing_key):
+    token = make_token(signing_key[0], "user-a")
+    assert_rejected(TestClient(app), f"/ws/device-b?token={token}")
+
+
+def test_logged_out_device_is_rejected(signing_key):
+    token = make_token(signing_key[0], "user-a")
+    assert_rejected(TestClient(app), f"/ws/device-old?token={token}")
+
+
+def test_non_json_jwks_response_is_rejected(monkeypatch, signing_key):
+    # Auth0 or a proxy answering with an HTML error page instead of the JWKS
+    monkeypatch.setattr(auth, "_jwks_cache", None)
+    monkeypatch.setattr(
+        httpx.Client, "get",
+        lambda self, url, **kwargs: httpx.Response(200, text="<html>Bad gateway</html>"),
+    )
+    token = make_token(signing_key[0], "user-a")
+    assert_rejected(TestClient(app), f"/ws/device-a?token={token}")
+
+
+def test_force_logout_before_registration_is_closed(monkeypatch, signing_key):
+    real_authorize = main.authorize_websocket
+
+    def authorize_then_force_logout(token, device_id):
+        user_id = real_authorize(token, device_id)
+        # The device is force-logged-out after the ownership check but before
+        # its socket is registered, so the logout notification finds nothing
+        db = SessionLocal()
+        db.query(DeviceSession).filter(DeviceSession.device_id == device_id).update({"is_active": "false"})
+        db.commit()
+        db.close()
+        return user_id
+
+    monkeypatch.setattr(main, "authorize_websocket", authorize_then_force_logout)
+    token = make_token(signing_key[0], "user-a")
+    with TestClient(app).websocket_connect(f"/ws/device-a?token={token}") as websocket:
+        # Without the re-check this would be answered with a pong
+        websocket.send_text(json.dumps({"type": "ping"}))
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            websocket.receive_text()
+    assert exc_info.value.code == status.WS_1008_POLICY_VIOLATION
+    assert "device-a" not in manager.active_connections
@@ -0,0 +1,154 @@
+import asyncio
+
+from fastapi import status
+
+from app.websocket_manager import ConnectionManager, WS_REPLACED_CLOSE_CODE
+
+
+class FakeWebSocket:
+    def __init__(self, accept_gate: asyncio.Event = None):
+        self.accept_gate = accept_gate
+        self.accepted = False
+        self.close_code = None
+        self.sent = []
+
+    async def accept(self):
+        if self.accept_gate is not None:
+            await self.accept_gate.wait()
+        self.accepted = True
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        self.close_code = code
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+
+def test_concurrent_duplicate_connect_is_rejected():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=3)
+        gate = asyncio.Event()
+        first, second = FakeWebSocket(accept_gate=gate), FakeWebSocket()
+
+        pending = asyncio.ensure_future(manager.connect(first, "d1", "u1"))
+        await asyncio.sleep(0)  # first handshake is now waiting in accept()
+
+        assert await manager.connect(second, "d1", "u1") is False
+        assert second.close_code == status.WS_1008_POLICY_VIOLATION
+        assert not second.accepted
+
+        gate.set()
+        assert await pending is True
+        assert manager.active_connections["d1"] is first
+
+    asyncio.run(scenario())
+
+
+def test_device_owned_by_another_user_is_rejected():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=3)
+        owner, intruder = FakeWebSocket(), FakeWebSocket()
+
+        assert await manager.connect(owner, "d1", "u1") is True
+        assert await manager.connect(intruder, "d1", "u2") is False
+        assert intruder.close_code == status.WS_1008_POLICY_VIOLATION
+        assert manager.active_connections["d1"] is owner
+        assert "u2" not in manager.user_devices
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replaces_previous_socket():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=1)
+        old, new = FakeWebSocket(), FakeWebSocket()
+
+        assert await manager.connect(old, "d1", "u1") is True
+        # Replacing does not count against the cap even when it is full
+        assert await manager.connect(new, "d1", "u1") is True
+        await asyncio.sleep(0)  # let the background close of the old socket run
+
+        assert old.close_code == WS_REPLACED_CLOSE_CODE
+        assert manager.active_connections["d1"] is new
+        assert manager.user_devices == {"u1": {"d1"}}
+
+    asyncio.run(scenario())
+
+
+def test_per_user_cap():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=2)
+        for device_id in ("d1", "d2"):
+            assert await manager.connect(FakeWebSocket(), device_id, "u1") is True
+
+        extra = FakeWebSocket()
+        assert await manager.connect(extra, "d3", "u1") is False
+        assert extra.close_code == status.WS_1008_POLICY_VIOLATION
+        assert "d3" not in manager.active_connections
+
+        # Other users have their own allowance
+        assert await manager.connect(FakeWebSocket(), "d4", "u2") is True
+
+        # Freeing a slot lets the user connect again
+        manager.disconnect("d1")
+        assert await manager.connect(FakeWebSocket(), "d3", "u1") is True
+
+    asyncio.run(scenario())
+
+
+def test_stale_disconnect_keeps_live_socket():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=3)
+        old, new = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old, "d1", "u1")
+        await manager.connect(new, "d1", "u1")
+
+        manager.disconnect("d1", old)
+
+        assert manager.active_connections["d1"] is new
+        assert manager.device_user_mapping["d1"] == "u1"
+        assert manager.user_devices == {"u1": {"d1"}}
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_cleans_up_user_devices():
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=3)
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(first, "d1", "u1")
+        await manager.connect(second, "d2", "u1")
+
+        manager.disconnect("d1", first)
+        assert manager.user_devices == {"u1": {"d2"}}
+
+        manager.disconnect("d2", second)
+        assert manager.user_devices == {}
+        assert manager.active_connections == {}
+        assert manager.device_user_mapping == {}
+
+    asyncio.run(scenario())
+
+
+def test_logout_notification_does_not_close_reconnected_socket(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager(max_connections_per_user=3)
+        old, new = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old, "d1", "u1")
+
+        real_sleep = asyncio.sleep
+
+        async def reconnect_during_sleep(delay):
+            # The device drops and reconnects while the notification is in flight
+            await manager.connect(new, "d1", "u1")
+            await real_sleep(0)
+
+        monkeypatch.setattr(asyncio, "sleep", reconnect_during_sleep)
+        await manager.send_logout_notification("d1")
+        monkeypatch.setattr(asyncio, "sleep", real_sleep)
+
+        assert old.sent and old.close_code is not None
+        assert new.close_code is None
+        assert manager.active_connections["d1"] is new
+
+    asyncio.run(scenario())
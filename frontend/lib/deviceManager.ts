@@ -100,8 +100,10 @@ export class DeviceManager {
         }
       };
       
-      this.websocket.onclose = () => {
+      this.websocket.onclose = (event) => {
         console.log('WebSocket disconnected');
+        // 4000: superseded by a newer connection for this device, don't fight it
+        if (event.code === 4000) return;
         this.attemptReconnect(token);
       };
       